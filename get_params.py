@@ -169,6 +169,9 @@ def get_default_model_config() -> Dict:
         "system_prompt": "Provide complete structured response for a formal software audit, given this Context:\n'{context}'\n",
         "instruction_prompt": "\nPlease provide a very detailed, accurate, and insightful Response to this Instruction and include your reasoning step by step.\n{query}\n",
         "prompt_template": "### System: {system_prompt}### Instruction:{instruction_prompt}### Response:",
+        "llm_batch_size": 1,
+        "llm_max_workers": 1,
+        "llm_cache_pathname": "",
         "inference_model": {
             "model_import_path": "ctransformers.AutoModelForCausalLM",
             "model_inference_function": "from_pretrained",
@@ -254,7 +257,8 @@ def instantiate_model(model_config: Dict) -> object:
     try:
         module_name, class_name = model_config["model_import_path"].rsplit(".", 1)
         ModelClass = getattr(importlib.import_module(module_name), class_name)
-        model_params = model_config["model_params"]
+        # pop model_path from a copy so the config still identifies the model
+        model_params = dict(model_config["model_params"])
         inference_function_name = model_config["model_inference_function"]
         if inference_function_name != "":
             inference_function = getattr(ModelClass, inference_function_name)
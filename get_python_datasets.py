@@ -14,6 +14,12 @@ Requirements:
         g. Provide `generate` method to generate responses for all questions
         and return the instruct_list.
         h. Internally manage question mapping to file details.
+        i. Defer LLM questions and send them in batches of `llm_batch_size`
+        rows, each batch marshaled into a single prompt.
+        j. Send up to `llm_max_workers` LLM batches concurrently.
+        k. Provide `iter_generate` method to yield each instruction as soon as
+        no later question can change it.
+        l. Cache LLM responses in `llm_cache_pathname` when it is configured.
 [req02] The `get_python_datasets` function shall:
         a. Accept a Python file path, file details, base name, questions list,
         and model config as input.
@@ -22,12 +28,49 @@ Requirements:
         d. Return the generated `instruct_list`.
 [req03] The `clean_and_get_unique_elements` function shall:
         a. Clean an input string (str) and return a string of unique elements.
+[req04] The `get_unique_elements` function shall:
+        a. Clean an input string (str) and return a tuple of unique elements.
+[req05] The `ResponseCache` class shall:
+        a. Store LLM responses in a sqlite database keyed by a hash of the
+        model configuration and prompt.
+Performance:
+    With use_llm, generation time is dominated by waiting on the language
+    model, so it is reduced by batching, concurrent, and cached LLM calls
+    rather than by speeding up the string cleaning. Without use_llm, the
+    time is spent building strings and dicts. Set the PY2DATASET_TRACE
+    environment variable to log how long each file spends on the questions
+    and on the LLM calls. The timings are logged as warnings so they are
+    still shown with --quiet.
 """
 import logging
+import os
 import re
 import math
 import json
-from typing import Dict, List, Tuple
+import hashlib
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from string import Formatter
+from time import perf_counter
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Log the time spent on the questions and on the LLM calls for each file
+TRACE = bool(os.environ.get("PY2DATASET_TRACE"))
+
+# Parses templates for split_template and applies their conversions
+TEMPLATE_FORMATTER = Formatter()
+
+# Runs of blank lines collapsed in each LLM response
+BLANK_LINES_RE = re.compile(r"\n\s*\n")
+
+# Characters that split elements or change the brace level when cleaning
+ELEMENT_DELIMITERS_RE = re.compile(r"[{},]")
+
+# Row delimiters used to marshal several LLM queries into a single prompt
+ROW_MARKER = "### ROW {} ###"
+ROW_MARKER_RE = re.compile(r"^### ROW (\d+) ###[ \t]*$", re.MULTILINE)
 
 
 def group_json(input_json: Dict) -> Dict:
@@ -52,33 +95,184 @@ def group_json(input_json: Dict) -> Dict:
     return output_json
 
 
-def clean_and_get_unique_elements(input_str: str) -> str:
+@lru_cache(maxsize=256)
+def split_template(
+    template: str,
+) -> Tuple[Tuple[str, Optional[str], Optional[str], Optional[str]], ...]:
     """
-    Clean an input string (str) and return a string of unique elements.
+    Split a str.format template into (literal text, field name, format spec,
+    conversion) parts.
+    Args:
+        template (str): The template to be split.
+    Returns:
+        Tuple[Tuple[str, Optional[str], Optional[str], Optional[str]], ...]:
+            The parts of the template.
+    """
+    return tuple(TEMPLATE_FORMATTER.parse(template))
+
+
+def fill_template(
+    parts: Tuple[Tuple[str, Optional[str], Optional[str], Optional[str]], ...],
+    **fields: object,
+) -> str:
+    """
+    Fill a template split by split_template without parsing it again.
+    Args:
+        parts (Tuple[Tuple[str, Optional[str], Optional[str], Optional[str]], ...]):
+            The parts of the template.
+        **fields (object): The values of the template fields.
+    Returns:
+        str: The filled template, as str.format would render it.
+    """
+    pieces = []
+    for literal_text, field_name, format_spec, conversion in parts:
+        pieces.append(literal_text)
+        if field_name is None:
+            continue
+        if field_name in fields:
+            value = fields[field_name]
+        else:  # attribute or index lookups such as {info.name} or {items[0]}
+            value = TEMPLATE_FORMATTER.get_field(field_name, (), fields)[0]
+        if conversion:
+            value = TEMPLATE_FORMATTER.convert_field(value, conversion)
+        if format_spec and "{" in format_spec:  # nested fields such as {name:>{width}}
+            format_spec = fill_template(split_template(format_spec), **fields)
+        pieces.append(format(value, format_spec) if format_spec else str(value))
+    return "".join(pieces)
+
+
+@lru_cache(maxsize=4096)
+def get_unique_elements(input_str: str) -> Tuple[str, ...]:
+    """
+    Clean an input string (str) and return a tuple of unique elements.
+    Results are cached as the same file details are cleaned for many questions.
     Args:
         input_str (str): The input string to be cleaned.
     Returns:
-        str: The cleaned string.
+        Tuple[str, ...]: The cleaned elements.
     """
 
     def element_generator(input_str):
         start, brace_level = 0, 0
-        for i, char in enumerate(input_str):
-            if char in "{}":
+        for match in ELEMENT_DELIMITERS_RE.finditer(input_str):
+            char = match.group()
+            if char == ",":
+                if brace_level == 0:
+                    yield input_str[start : match.start()]
+                    start = match.end()
+            else:
                 brace_level += 1 if char == "{" else -1
-            elif char == "," and brace_level == 0:
-                yield input_str[start:i]
-                start = i + 1
         yield input_str[start:]
 
     input_str = input_str.strip("[]'\"").strip()
-    cleaned_elements = [
-        element.strip("'\" ").strip()
-        for element in element_generator(input_str)
-        if element.strip()
-    ]
-    returned_elements = ", ".join(cleaned_elements)
-    return returned_elements
+    # Without braces every comma is top level, so split in one C-level pass
+    if "{" in input_str or "}" in input_str:
+        elements = element_generator(input_str)
+    else:
+        elements = input_str.split(",")
+    # dict.fromkeys drops repeated elements and keeps their first-seen order
+    return tuple(
+        dict.fromkeys(
+            cleaned
+            for element in elements
+            if (cleaned := element.strip("'\" ").strip())
+        )
+    )
+
+
+def clean_and_get_unique_elements(input_str: str) -> str:
+    """
+    Clean an input string (str) and return a string of unique elements.
+    Args:
+        input_str (str): The input string to be cleaned.
+    Returns:
+        str: The cleaned string.
+    """
+    return ", ".join(get_unique_elements(input_str))
+
+
+class ResponseCache:
+    """
+    Persistent sqlite cache of language model responses.
+    Attributes:
+        connection (sqlite3.Connection): The connection to the cache database.
+        lock (threading.Lock): Serializes access from the LLM worker threads.
+    Methods:
+        get_key(*parts: str) -> str:
+            Get the cache key for the given parts.
+        get(key: str) -> Optional[str]:
+            Get the cached response for a key, or None if not cached.
+        set(key: str, response: str) -> None:
+            Cache the response for a key.
+        close() -> None:
+            Close the connection to the cache database.
+    """
+
+    def __init__(self, pathname: str) -> None:
+        """
+        Initialize the ResponseCache class.
+        Args:
+            pathname (str): The path and filename of the cache database.
+        Returns:
+            None
+        """
+        self.connection = sqlite3.connect(pathname, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT)"
+        )
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_key(*parts: str) -> str:
+        """
+        Get the cache key for the given parts.
+        Args:
+            *parts (str): The model and prompt the response depends on.
+        Returns:
+            str: The hex digest of the parts.
+        """
+        return hashlib.blake2b(
+            "\0".join(parts).encode("utf-8", "surrogatepass"), digest_size=16
+        ).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Get the cached response for a key.
+        Args:
+            key (str): The cache key.
+        Returns:
+            Optional[str]: The cached response, or None if not cached.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT response FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, response: str) -> None:
+        """
+        Cache the response for a key.
+        Args:
+            key (str): The cache key.
+            response (str): The response to be cached.
+        Returns:
+            None
+        """
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, response) VALUES (?, ?)",
+                (key, response),
+            )
+
+    def close(self) -> None:
+        """
+        Close the connection to the cache database.
+        Args:
+            None
+        Returns:
+            None
+        """
+        self.connection.close()
 
 
 class DatasetGenerator:
@@ -91,21 +285,40 @@ class DatasetGenerator:
         questions (List[Dict[str, str]]): Questions for generating responses.
         instruct_list (List[Dict[str, str]]): Storage for generated instructions.
         question_mapping (Dict[str, str]): Mapping of question types to keys in file details.
+        question_items (Dict[str, List[Tuple]]): Context, info, and mapping for each question type.
+        file_context (str): The file code used as the input of file questions.
         use_llm (bool): Flag indicating if a language model should be used.
         llm (object): The language model for generating responses.
         prompt (str): The prompt format for querying the language model.
+        llm_batch_size (int): Number of LLM questions sent in one prompt.
+        llm_max_workers (int): Number of LLM prompts sent concurrently.
+        prompt_parts (Tuple[Tuple, ...]): The prompt template split by split_template.
+        llm_cache_pathname (str): The sqlite file caching LLM responses, if any.
+        llm_cache (ResponseCache): The open LLM response cache, or None.
+        llm_cache_id (str): The model configuration included in each cache key.
+        pending_llm (List[Tuple]): LLM questions deferred until all others are answered.
     Methods:
+        get_question_items() -> Dict[str, List[Tuple[str, Dict, Dict]]]:
+            Get the (context, info, mapping) items each question type is asked about.
+        call_llm(prompt: str) -> str:
+            Get the language model output for a prompt, using the llm_cache if set.
         add_to_list(list_to_update: List[Dict], query: str, response: str,
         additional_field=None) -> List[Dict]:
             Add response to the instruct list.
         get_response_from_llm(query: str, context: str) -> str:
             Get language model response to query for given context.
+        get_batched_response_from_llm(items: List[Tuple[str, str]]) -> List[str]:
+            Get language model responses to several queries using one prompt.
+        process_pending_llm() -> None:
+            Get LLM responses to the deferred questions and add them to the instruct_list.
         process_question(question_type: str, question_id: str, query: str,
         context: str, info: Dict) -> None:
             Process question and add generated response to the instruct_list.
         process_question_type(question_type: str, question_id: str,
         question_text: str) -> None:
             Process question related to file, function, class, or method.
+        iter_generate() -> Iterator[Dict]:
+            Generate responses for all the questions, yielding each instruction.
         generate() -> Tuple[List[Dict], List[Dict]]:
             Generate responses for all the questions and return the instruct_list.
     """
@@ -134,22 +347,87 @@ class DatasetGenerator:
         self.file_details = file_details
         self.base_name = base_name
         self.questions = questions
+        if model_config is not None and model_config["model"] is None:
+            logging.error("Language model not available, generating without it")
+            model_config = None
         self.model_config = model_config
         if model_config is not None:
             self.llm = model_config["model"]
             self.use_llm = True
             self.detailed = detailed
+            self.llm_batch_size = max(1, model_config.get("llm_batch_size", 1))
+            self.llm_max_workers = max(1, model_config.get("llm_max_workers", 1))
+            self.prompt_parts = split_template(
+                model_config["prompt_template"].format(
+                    system_prompt=model_config["system_prompt"],
+                    instruction_prompt=model_config["instruction_prompt"],
+                )
+            )
+            self.llm_cache_pathname = model_config.get("llm_cache_pathname")
+            self.llm_cache_id = json.dumps(
+                model_config["inference_model"], sort_keys=True, default=str
+            )
         else:
             self.llm = None
             self.use_llm = False
             self.detailed = False
+            self.llm_batch_size = 1
+            self.llm_max_workers = 1
+            self.prompt_parts = ()
+            self.llm_cache_pathname = ""
+            self.llm_cache_id = ""
+        self.llm_cache = None
         self.instruct_list = []
+        self.pending_llm = []
         self.question_mapping = {
             "file": "file",
             "function": "functions",
             "class": "classes",
             "method": "classes",
         }
+        self.question_items = self.get_question_items()
+        self.file_context = "".join(
+            ["```python\n", str(self.file_details["file_info"]["file_code"]), "\n```"]
+        )
+
+    def get_question_items(self) -> Dict[str, List[Tuple[str, Dict, Dict]]]:
+        """
+        Get the (context, info, mapping) items each question type is asked about.
+        Args:
+            None
+        Returns:
+            Dict[str, List[Tuple[str, Dict, Dict]]]: The items for each question type.
+        """
+        file_info = self.file_details["file_info"]
+        question_items = {
+            "file": [(file_info["file_code"], file_info, {"filename": self.base_name})]
+        }
+        for question_type in ["function", "class"]:
+            question_items[question_type] = [
+                (
+                    info[f"{question_type}_code"],
+                    info,
+                    {"filename": self.base_name, f"{question_type}_name": name},
+                )
+                for name, info in self.file_details[
+                    self.question_mapping[question_type]
+                ].items()
+            ]
+        question_items["method"] = [
+            (
+                method_info["method_code"],
+                method_info,
+                {
+                    "filename": self.base_name,
+                    "class_name": class_name,
+                    "method_name": f"{class_name}.{key[len('class_method_'):]}",
+                },
+            )
+            for class_name, class_info in self.file_details["classes"].items()
+            for key, method_info in class_info.items()
+            if key.startswith("class_method_")
+        ]
+        return question_items
 
     def add_to_list(
         self,
@@ -173,19 +451,34 @@ class DatasetGenerator:
         )
         return list_to_update
 
-    def get_response_from_llm(self, query: str, context: str) -> str:
+    def call_llm(self, prompt: str) -> str:
         """
-        Get language model response to query for given context.
+        Get the language model output for a prompt, using the llm_cache if set.
         Args:
-            query (str): The query to be used for generating the response.
-            context (str): The context to be used for generating the response.
+            prompt (str): The prompt to be sent to the language model.
         Returns:
-            str: The generated response.
+            str: The language model output.
+        """
+        if self.llm_cache is None:
+            return self.llm(prompt)
+        key = ResponseCache.get_key(self.llm_cache_id, prompt)
+        response = self.llm_cache.get(key)
+        if response is None:
+            response = self.llm(prompt)
+            self.llm_cache.set(key, response)
+        return response
+
+    def get_code_qa_list(self) -> List[Tuple[str, str]]:
+        """
+        Get the Q and A pairs to be used as additional LLM context.
+        Args:
+            None
+        Returns:
+            List[Tuple[str, str]]: The code element instructions and their outputs.
         """
-        # List of dictionaries for Q and A pairs to be used as additional LLM context
         excluded_instructions = ["Call code graph", "Docstring"]
-        code_qa_list = [
-            {item["instruction"].split(" in Python file:")[0]: item["output"]}
+        return [
+            (item["instruction"].split(" in Python file:")[0], item["output"])
             for item in self.instruct_list
             if not any(
                 item["instruction"].startswith(prefix)
@@ -193,6 +486,29 @@ class DatasetGenerator:
             )
         ]
 
+    @staticmethod
+    def get_code_elements_json(code_qa_list: List[Tuple[str, str]]) -> str:
+        """
+        Get the JSON formatted code elements appended to each LLM response.
+        Args:
+            code_qa_list (List[Tuple[str, str]]): The code element instructions and outputs.
+        Returns:
+            str: The JSON formatted code elements.
+        """
+        return json.dumps(group_json({"Code Elements": dict(code_qa_list)}), indent=4)
+
+    def get_prompt(
+        self, query: str, context: str, code_qa_list: List[Tuple[str, str]]
+    ) -> str:
+        """
+        Get the LLM prompt for a query, managing the context length.
+        Args:
+            query (str): The query to be used for generating the response.
+            context (str): The context to be used for generating the response.
+            code_qa_list (List[Tuple[str, str]]): The code element instructions and outputs.
+        Returns:
+            str: The prompt, or an empty string if the context is too long.
+        """
         # Manage context length for LLM starting with the longest and most comprehensive
         context_strategies = [
             lambda: "```python\n{}\n```".format(str(context)),
@@ -210,68 +526,140 @@ class DatasetGenerator:
             "context_length"
         ]
 
-        prompt_template = self.model_config["prompt_template"].format(
-            system_prompt=self.model_config["system_prompt"],
-            instruction_prompt=self.model_config["instruction_prompt"],
-        )
-
         for strategy in context_strategies:
             context = strategy()
-            full_context = f"{context}\nCode Elements:\n{code_qa_list}"
-            prompt = prompt_template.format(context=full_context, query=query)
+            full_context = f"{context}\nCode Elements:\n{[{k: v} for k, v in code_qa_list]}"
+            prompt = fill_template(self.prompt_parts, context=full_context, query=query)
             context_size = len(self.llm.tokenize(prompt))
-            print(f"Context size: {context_size}")
+            logging.info("Context size: %d", context_size)
             if context_size <= 0.70 * max_context_length:
-                break
+                return prompt
             else:
                 logging.error(
-                    f"Model response failed, increase py2dataset_model_config.yaml context_length > {math.ceil(context_size/0.70)}"
+                    "Model response failed, increase py2dataset_model_config.yaml context_length > %d",
+                    math.ceil(context_size / 0.70),
                 )
                 return ""
+        return ""
+
+    def get_response_from_llm(self, query: str, context: str) -> str:
+        """
+        Get language model response to query for given context.
+        Args:
+            query (str): The query to be used for generating the response.
+            context (str): The context to be used for generating the response.
+        Returns:
+            str: The generated response.
+        """
+        code_qa_list = self.get_code_qa_list()
+        prompt = self.get_prompt(query, context, code_qa_list)
+        if not prompt:
+            return ""
 
         response = ""
         try:  # get response from LLM
-            response = re.sub(r"\n\s*\n", "\n\n", self.llm(prompt))
-            code_elements_combined = {}
-            for item in code_qa_list:
-                code_elements_combined.update(item)
-            code_elements_json = json.dumps(
-                {"Code Elements": code_elements_combined}, indent=4
-            )
-            code_elements_json = json.dumps(
-                group_json(json.loads(code_elements_json)), indent=4
-            )
-            response += "\n" + code_elements_json  # Appending the JSON formatted string
-            logging.info(f"***Overall Response: {response}")
-        except Exception as error:
-            logging.error(f"Failed to generate model response: {error}")
-
-        if self.detailed:  # Get llm response for each code_qa_list item
-            for item in code_qa_list:
-                instruct_key = list(item.keys())[0]
-                instruct_value = list(item.values())[0]
-                query = f"Describe the purpose and significance of these {instruct_key}: [{instruct_value}] within the code."
-                prompt_template = self.model_config["prompt_template"].format(
-                    system_prompt=self.model_config["system_prompt"],
-                    instruction_prompt=self.model_config["instruction_prompt"],
-                )
-                prompt = prompt_template.format(context=context, query=query)
-                try:
-                    item_response = re.sub(r"\n\s*\n", "\n\n", self.llm(prompt))
-                    logging.info(f"\n***Itemized Response: {query}\n{item_response}")
-                except Exception as error:
-                    logging.error(f"Failed to generate model response: {error}")
-
-                # replace the output value in self.instruct_list with the item.key + this_response
-                for i, instruct_item in enumerate(self.instruct_list):
-                    if instruct_item["instruction"].startswith(list(item.keys())[0]):
-                        instruct_item[
-                            "output"
-                        ] = f"{instruct_value}\n\nPurpose and Significance:\n{item_response}"
-                        break
+            response = BLANK_LINES_RE.sub("\n\n", self.call_llm(prompt))
+            # Appending the JSON formatted string
+            response += "\n" + self.get_code_elements_json(code_qa_list)
+            logging.info("***Overall Response: %s", response)
+        except Exception:
+            logging.exception("Failed to generate model response")
 
         return response
 
+    def get_batched_response_from_llm(self, items: List[Tuple[str, str]]) -> List[str]:
+        """
+        Get language model responses to several queries using one prompt.
+        Args:
+            items (List[Tuple[str, str]]): The (query, context) pairs.
+        Returns:
+            List[str]: The generated responses, in the order of the items.
+        """
+        if len(items) == 1:
+            return [self.get_response_from_llm(*items[0])]
+
+        # Marshal each (query, context) pair into a numbered row of one prompt
+        rows = [
+            f"{ROW_MARKER.format(i)}\nCONTEXT:\n```python\n{context}\n```\nQUERY: {query}"
+            for i, (query, context) in enumerate(items, 1)
+        ]
+        query = "\n\n".join(
+            [
+                "Respond to the QUERY of each ROW below separately. Begin each "
+                "response with the marker line of its ROW, exactly as given.",
+                *rows,
+            ]
+        )
+        code_qa_list = self.get_code_qa_list()
+        full_context = f"Code Elements:\n{[{k: v} for k, v in code_qa_list]}"
+        prompt = fill_template(self.prompt_parts, context=full_context, query=query)
+        max_context_length = self.model_config["inference_model"]["model_params"][
+            "context_length"
+        ]
+        if len(self.llm.tokenize(prompt)) > 0.70 * max_context_length:
+            return [self.get_response_from_llm(*item) for item in items]
+
+        row_responses = {}
+        try:  # get response from LLM and split it back into rows
+            parts = ROW_MARKER_RE.split(self.call_llm(prompt))
+            row_responses = {
+                int(row): BLANK_LINES_RE.sub("\n\n", text).strip()
+                for row, text in zip(parts[1::2], parts[2::2])
+            }
+        except Exception:
+            logging.exception("Failed to generate model response")
+
+        code_elements_json = self.get_code_elements_json(code_qa_list)
+        responses = []
+        for i, item in enumerate(items, 1):
+            if row_responses.get(i):
+                response = f"{row_responses[i]}\n{code_elements_json}"
+                logging.info("***Overall Response: %s", response)
+            else:  # row missing from the batched response, ask for it alone
+                response = self.get_response_from_llm(*item)
+            responses.append(response)
+
+        return responses
+
+    def get_detailed_responses(
+        self, code_qa_list: List[Tuple[str, str]], context: str
+    ) -> None:
+        """
+        Get llm response for each code_qa_list item and update the instruct_list.
+        Args:
+            code_qa_list (List[Tuple[str, str]]): The code element instructions and outputs.
+            context (str): The context to be used for generating the responses.
+        Returns:
+            None
+        """
+        max_context_length = self.model_config["inference_model"]["model_params"][
+            "context_length"
+        ]
+        for instruct_key, instruct_value in code_qa_list:
+            query = f"Describe the purpose and significance of these {instruct_key}: [{instruct_value}] within the code."
+            prompt = fill_template(self.prompt_parts, context=context, query=query)
+            context_size = len(self.llm.tokenize(prompt))
+            if context_size > 0.70 * max_context_length:
+                logging.error(
+                    "Detailed response skipped, increase py2dataset_model_config.yaml context_length > %d",
+                    math.ceil(context_size / 0.70),
+                )
+                continue
+            try:
+                item_response = BLANK_LINES_RE.sub("\n\n", self.call_llm(prompt))
+                logging.info("\n***Itemized Response: %s\n%s", query, item_response)
+            except Exception:
+                logging.exception("Failed to generate model response")
+                continue
+
+            # replace the output value in self.instruct_list with the item.key + this_response
+            for i, instruct_item in enumerate(self.instruct_list):
+                if instruct_item["instruction"].startswith(instruct_key):
+                    instruct_item[
+                        "output"
+                    ] = f"{instruct_value}\n\nPurpose and Significance:\n{item_response}"
+                    break
+
     def process_question(
         self, question_type: str, question_id: str, query: str, context: str, info: Dict
     ) -> None:
@@ -287,26 +675,43 @@ class DatasetGenerator:
             None
         """
         if question_id.endswith("code_graph") or question_id.endswith("docstring"):
-            response = info.get(question_id, {})
+            response = info.get(question_id)
+            if not response:  # skip empty code graphs and docstrings
+                return
+            if isinstance(response, (dict, list)):  # keep code graphs valid JSON
+                response = json.dumps(response)
         elif self.use_llm and question_id.endswith("purpose"):
-            response = self.get_response_from_llm(query, context)
+            # Defer LLM questions so they can be sent in batches by generate
+            self.pending_llm.append((question_type, question_id, query, context, info))
+            return
         else:
-            response = clean_and_get_unique_elements(str(info.get(question_id, "")))
+            response = info.get(question_id)
+            if not response:  # skip cleaning empty fields
+                return
+            response = clean_and_get_unique_elements(str(response))
+        self.add_response(question_type, query, context, response)
 
+    def add_response(
+        self, question_type: str, query: str, context: str, response: object
+    ) -> None:
+        """
+        Add the response to a question to the instruct_list.
+        Args:
+            question_type (str): The type of question that was processed.
+            query (str): The query that was processed.
+            context (str): The context used for generating the response.
+            response (object): The generated response.
+        Returns:
+            None
+        """
+        if not response or response == "None":
+            return
+        response_str = str(response).strip()
+        if not response_str:
+            return
         if question_type == "file":
-            context = "".join(
-                [
-                    "```python\n",
-                    str(self.file_details["file_info"]["file_code"]),
-                    "\n```",
-                ]
-            )
-        if response and response != "None":
-            response_str = str(response).strip()
-            if response_str:
-                self.instruct_list.append(
-                    {"instruction": query, "input": context, "output": response_str}
-                )
+            context = self.file_context
+        self.add_to_list(self.instruct_list, query, response_str, context)
 
     @staticmethod
     def get_string_from_info(info, item_type):
@@ -335,63 +740,130 @@ class DatasetGenerator:
         Returns:
             None
         """
-        if question_type == "file":
-            query = question_text.format(filename=self.base_name)
-            info = self.file_details["file_info"]
-            context = self.file_details["file_info"]["file_code"]
-            self.process_question(question_type, question_id, query, context, info)
-        elif question_type == "method":
-            for class_name, class_info in self.file_details["classes"].items():
-                for key, method_info in class_info.items():
-                    if key.startswith("class_method_"):
-                        method_name = f"{class_name}.{key[len('class_method_'):]}"
-                        context = method_info["method_code"]
-                        mapping = {"class_name": class_name, "method_name": method_name}
-                        query = question_text.format(filename=self.base_name, **mapping)
-                        self.process_question(
-                            question_type, question_id, query, context, method_info
-                        )
-        else:  # question_type is 'function' or 'class'
-            for name, info in self.file_details[
-                self.question_mapping[question_type]
-            ].items():
-                context = info[f"{question_type}_code"]
-                mapping = {f"{question_type}_name": name}
-                if question_id == f"{question_type}_purpose" and self.use_llm:
-                    variables_string = self.get_string_from_info(
-                        info, f"{question_type}_variables"
-                    )
-                    inputs_string = self.get_string_from_info(
-                        info, f"{question_type}_inputs"
-                    )
-                    combined_string = ", ".join(
-                        [s for s in [variables_string, inputs_string] if s]
+        # Keys used by the function and class purpose questions
+        add_variables = (
+            self.use_llm
+            and question_type in ["function", "class"]
+            and question_id == f"{question_type}_purpose"
+        )
+        variables_key = f"{question_type}_variables"
+        element_keys = [variables_key, f"{question_type}_inputs"]
+        methods_key = f"{question_type}_methods"
+        question_parts = split_template(question_text)
+
+        for context, info, mapping in self.question_items[question_type]:
+            if add_variables:
+                mapping = dict(mapping)
+                mapping[variables_key] = ", ".join(
+                    dict.fromkeys(
+                        element
+                        for key in element_keys
+                        if info[key]
+                        for element in get_unique_elements(str(info[key]))
                     )
-                    mapping[
-                        f"{question_type}_variables"
-                    ] = clean_and_get_unique_elements(combined_string)
+                )
+                if question_type == "class":
+                    mapping[methods_key] = self.get_string_from_info(info, methods_key)
 
-                    if question_type == "class":
-                        methods_string = self.get_string_from_info(
-                            info, f"{question_type}_methods"
-                        )
-                        mapping[f"{question_type}_methods"] = methods_string
+            query = fill_template(question_parts, **mapping)
+            self.process_question(question_type, question_id, query, context, info)
 
-                query = question_text.format(filename=self.base_name, **mapping)
-                self.process_question(question_type, question_id, query, context, info)
+    def process_pending_llm(self) -> None:
+        """
+        Get LLM responses to the deferred questions and add them to the instruct_list.
+        Args:
+            None
+        Returns:
+            None
+        """
+        if not self.pending_llm:
+            return
 
-    def generate(self) -> Tuple[List[Dict], List[Dict]]:
+        if self.llm_cache_pathname:
+            self.llm_cache = ResponseCache(self.llm_cache_pathname)
+        try:
+            # Send batches of llm_batch_size rows, up to llm_max_workers at a time
+            code_qa_list = self.get_code_qa_list()
+            batches = [
+                self.pending_llm[i : i + self.llm_batch_size]
+                for i in range(0, len(self.pending_llm), self.llm_batch_size)
+            ]
+            responses = [None] * len(batches)
+            with ThreadPoolExecutor(max_workers=self.llm_max_workers) as executor:
+                futures = {
+                    executor.submit(
+                        self.get_batched_response_from_llm,
+                        [(query, context) for _, _, query, context, _ in batch],
+                    ): i
+                    for i, batch in enumerate(batches)
+                }
+                for future in as_completed(futures):
+                    responses[futures[future]] = future.result()
+
+            # Add the responses in question order once all batches are done
+            for batch, batch_responses in zip(batches, responses):
+                for (question_type, _, query, context, _), response in zip(
+                    batch, batch_responses
+                ):
+                    self.add_response(question_type, query, context, response)
+
+            # As before batching, skip the detailed pass if every LLM prompt was rejected
+            if self.detailed and any(
+                response for batch_responses in responses for response in batch_responses
+            ):
+                self.get_detailed_responses(code_qa_list, self.file_context)
+        finally:
+            if self.llm_cache is not None:
+                self.llm_cache.close()
+                self.llm_cache = None
+        self.pending_llm = []
+
+    def iter_generate(self) -> Iterator[Dict]:
         """
-        Generate responses for all the questions and returns the instruct_list.
+        Generate responses for all the questions, yielding each instruction.
         Args:
             None
         Returns:
-            Tuple[List[Dict], List[Dict]]: The generated question-answer pairs and instructions.
+            Iterator[Dict]: The generated instructions.
         """
+        start = 0
+        question_seconds = 0.0
         for question in self.questions:
+            if TRACE:
+                started = perf_counter()
             self.process_question_type(
                 question["type"], question["id"], question["text"]
             )
+            if TRACE:
+                question_seconds += perf_counter() - started
+            if not self.detailed:  # detailed responses rewrite earlier instructions
+                yield from self.instruct_list[start:]
+                start = len(self.instruct_list)
+            if not self.use_llm:  # earlier instructions are only kept as LLM context
+                self.instruct_list.clear()
+                start = 0
+
+        if TRACE:
+            started = perf_counter()
+        self.process_pending_llm()
+        if TRACE:  # a warning, so the report survives --quiet
+            logging.warning(
+                "Timing for %s: questions %.3fs, LLM %.3fs",
+                self.base_name,
+                question_seconds,
+                perf_counter() - started,
+            )
+        yield from self.instruct_list[start:]
+
+    def generate(self) -> Tuple[List[Dict], List[Dict]]:
+        """
+        Generate responses for all the questions and returns the instruct_list.
+        Args:
+            None
+        Returns:
+            Tuple[List[Dict], List[Dict]]: The generated question-answer pairs and instructions.
+        """
+        self.instruct_list = list(self.iter_generate())
         return self.instruct_list
 
 
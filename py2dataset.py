@@ -37,7 +37,6 @@ from typing import Dict, List
 from multiprocessing import Process
 import subprocess
 import os
-import git
 import shlex
 
 from get_python_file_details import get_python_file_details
@@ -180,6 +179,8 @@ def clone_github_repo(url: str) -> str:
     Returns:
         str: The path to the cloned repository.
     """
+    import git  # deferred, only needed for GitHub repositories
+
     try:
         command = f"git ls-remote {shlex.quote(url)}"
         subprocess.run(
@@ -33,7 +33,6 @@ import logging
 from html import escape
 from pathlib import Path
 from typing import Dict, List
-import matplotlib.pyplot as plt
 import networkx as nx
 import yaml
 
@@ -216,6 +215,8 @@ def create_code_graph(file_details: Dict, base_name: str, output_subdir: Path) -
     Returns:
         None
     """
+    import matplotlib.pyplot as plt  # deferred, only needed to draw graphs
+
     # create graph
     graph_type = "entire_code_graph"
     G = nx.DiGraph()